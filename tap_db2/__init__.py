@@ -1,4 +1,5 @@
 #!/usr/bin/env python3
+import sys
 import singer
 from singer import utils
 from singer.catalog import Catalog
@@ -20,7 +21,7 @@ def main_impl():
     #Default db type (for discovery queries)
     args.config['db_type'] = "DB2"
     if args.discover:
-        discovery.discover(args.config).dump()
+        discovery.stream_discover(args.config, sys.stdout)
         print()
     elif args.catalog:
         do_sync(args, args.catalog)
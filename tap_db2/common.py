@@ -8,12 +8,26 @@ import backoff
 
 # pylint: disable=no-member
 
+DEFAULT_FETCH_BATCH_SIZE = 1000
+
+def _fetch_batch_size(config):
+    # A batch size below 1 would make fetchmany return no rows at all, which
+    # yield_jdbc can't tell apart from an empty result set.
+    batch_size = int(config.get("fetch_batch_size", DEFAULT_FETCH_BATCH_SIZE))
+    if batch_size < 1:
+        raise ValueError(
+            "fetch_batch_size must be at least 1, got {}".format(batch_size))
+    return batch_size
+
 def yield_jdbc(cursor):
+    # fetchmany sets the JDBC fetch size to the requested batch size, so the
+    # driver pulls rows from the server in batches rather than one at a time.
     while True:
-        record = cursor.fetchone()
-        if record is None:
+        records = cursor.fetchmany(cursor.arraysize)
+        if not records:
             break
-        yield [r.strip() if type(r) == str else r for r in record]
+        for record in records:
+            yield [r.strip() if type(r) == str else r for r in record]
         
 def _write_userprefs(host, port):
     """Creates or updates the ~/.iSeriesAccess/cwb_userprefs.ini file to
@@ -85,8 +99,10 @@ def connection(config):
 
 class get_cursor(object):
     def __init__(self, config):
+        batch_size = _fetch_batch_size(config)
         self.conn = connection(config)
         self.cur = self.conn.cursor()
+        self.cur.arraysize = batch_size
 
     def __enter__(self):
         return self.cur
@@ -1,5 +1,8 @@
 import csv
+import json
 from collections import namedtuple
+from itertools import groupby
+from operator import itemgetter
 from singer.catalog import Catalog, CatalogEntry
 import singer
 from singer import metadata
@@ -25,255 +28,211 @@ Column = namedtuple("Column", [
 ])
 
 SUPPORTED_TYPES = {"T", "V", "P"}
+# https://www.ibm.com/support/knowledgecenter/ssw_ibm_i_71/db2/rbafzcatsystbls.htm
+KNOWN_TABLE_TYPES = {
+    "A": "Alias",
+    "L": "Logical file",
+    "M": "Materialized query table",
+    "P": "Physical file",
+}
 
 def _question_marks(lst):
     return ",".join("?" * len(lst))
 
 def _replace_lst(lst):
     return ",".join(f"'{key}'" for key in lst)
+
+def _filter_schemas(config):
+    """Returns the list of schemas from the "filter_schemas" CSV config
+    value, or an empty list when discovery isn't restricted."""
+    schema_csv = config.get("filter_schemas", "")
+    return [s.strip() for s in next(csv.reader([schema_csv]))]
             
 # Note the _query_* functions mainly exist for the sake of mocking in unit
 # tests. Normally I would prefer to have integration tests than mock out this
 # data, but DB2 databases aren't easy to come by and if there is a lot of data
 # these queries can be quite slow.
-def _query_tables(config):
-    """Queries the qsys2 tables catalog and returns an iterator containing the
-    raw results."""
+def _query_catalog(config):
+    """Queries the tables, columns and primary key catalogs in a single
+    statement and returns an iterator containing the raw results. Each row
+    describes one column of a table, followed by the column's position in the
+    table's primary key (or None). Data types are lowercased by the query.
+    Rows are ordered by table and then by the column's ordinal position."""
+    # We use the qsys2.systables catalog rather than
+    # information_schema.tables because it contains better information
+    # about the "table_type." The information_schema table doesn't
+    # distinguish between tables and data files.
     if config["db_type"] == "DB2":
         sql = """
-                SELECT sys.tabschema as table_schema, 
-               sys.tabname as table_name,
-               sys.type as table_type
-          FROM syscat.tables sys
-         WHERE sys.type IN ({})
-        """.format(_replace_lst(SUPPORTED_TYPES))        
-    else: 
+            SELECT t.tabschema as table_schema,
+                   t.tabname as table_name,
+                   t.type as table_type,
+                   c.colname as column_name,
+                   LOWER(c.typename) as datatype,
+                   c.length as character_maximum_length,
+                   case when c.typename = 'DECIMAL' then c.length else null end as numeric_precision,
+                   c.scale as numeric_scale,
+                   c.text as ccsid,
+                   k.colseq as key_position
+              FROM syscat.tables t
+              LEFT JOIN syscat.columns c
+                ON c.tabschema = t.tabschema
+               AND c.tabname = t.tabname
+              LEFT JOIN (SELECT a.tabschema,
+                                a.tabname,
+                                a.colname,
+                                a.colseq
+                           FROM syscat.keycoluse a
+                           JOIN syscat.tabconst b
+                             ON a.tabschema = b.tabschema
+                            AND a.tabname = b.tabname
+                            AND a.constname = b.constname
+                          WHERE b.type = 'P') k
+                ON k.tabschema = c.tabschema
+               AND k.tabname = c.tabname
+               AND k.colname = c.colname
+             WHERE t.type IN ({})
+        """.format(_replace_lst(SUPPORTED_TYPES))
+        order_by = "ORDER BY t.tabschema, t.tabname, c.colno"
+        schema_column = "t.tabschema"
+    else:
         sql = """
-        SELECT table_schema,
-               table_name,
-               table_type
-          FROM qsys2.systables
-         WHERE table_type IN ({})
+            SELECT t.table_schema,
+                   t.table_name,
+                   t.table_type,
+                   c.column_name,
+                   LOWER(c.data_type) as data_type,
+                   c.character_maximum_length,
+                   c.numeric_precision,
+                   c.numeric_scale,
+                   c.ccsid,
+                   k.ordinal_position
+              FROM qsys2.systables t
+              LEFT JOIN qsys2.syscolumns c
+                ON c.table_schema = t.table_schema
+               AND c.table_name = t.table_name
+              LEFT JOIN (SELECT A.table_schema,
+                                A.table_name,
+                                A.column_name,
+                                A.ordinal_position
+                           FROM qsys2.syskeycst A
+                           JOIN qsys2.syscst B
+                             ON A.constraint_schema = B.constraint_schema
+                            AND A.constraint_name = B.constraint_name
+                          WHERE B.constraint_type = 'PRIMARY KEY') k
+                ON k.table_schema = c.table_schema
+               AND k.table_name = c.table_name
+               AND k.column_name = c.column_name
+             WHERE t.table_type IN ({})
         """.format(_replace_lst(SUPPORTED_TYPES))
-    schema_csv = config.get("filter_schemas", "")
-    schemas_ = [s.strip() for s in next(csv.reader([schema_csv]))]
-    if schemas_:
-        if config["db_type"] == "DB2":
-            sql += "AND sys.tabschema IN ({})".format(_replace_lst(schemas_))
-        else:
-            sql += "AND table_schema IN ({})".format(_replace_lst(schemas_))
+        order_by = "ORDER BY t.table_schema, t.table_name, c.ordinal_position"
+        schema_column = "t.table_schema"
+    binds = _filter_schemas(config)
+    if binds:
+        sql += "AND {} IN ({})\n".format(schema_column, _question_marks(binds))
+    sql += order_by
     with get_cursor(config) as cursor:
-        cursor.execute(sql)
+        LOGGER.info("sql: %s, binds: %s", sql, binds)
+        cursor.execute(sql, binds)
         yield from yield_jdbc(cursor)
 
-def _query_columns(config):
-    """Queries the qsys2 columns catalog and returns an iterator containing the
-    raw results."""
-    with get_cursor(config) as cursor:
-        schema_csv = config.get("filter_schemas", "")
-        binds = [s.strip() for s in next(csv.reader([schema_csv]))]
-        if len(binds) != 0:
-            if config["db_type"] == "DB2":
-                sql = """
-                SELECT sys.tabschema as table_schema,
-                          sys.tabname as table_name,
-                          sys.colname as column_name,
-                          sys.typename as datatype,
-                          sys.length as character_maximum_length,
-                          case when sys.typename = 'DECIMAL' then sys.LENGTH else null end as numeric_precision,
-                          sys.scale as numeric_scale,
-                          sys.text as ccsid
-                    FROM syscat.COLUMNS sys
-                    WHERE sys.tabschema IN ({})
-                """.format(_replace_lst(binds))
-            else:
-                sql = """
-                SELECT table_schema,
-                       table_name,
-                       column_name,
-                       data_type,
-                       character_maximum_length,
-                       numeric_precision,
-                       numeric_scale,
-                       ccsid
-                  FROM qsys2.syscolumns
-                 WHERE table_schema IN ({})
-                """.format(_replace_lst(binds))
-            LOGGER.info("sql: %s, binds: %s", sql, binds)
-            cursor.execute(sql)
-        else:
-            if config["db_type"] == "DB2":
-                cursor.execute("""
-                SELECT sys.tabschema as table_schema,
-                          sys.tabname as table_name,
-                          sys.colname as column_name,
-                          sys.typename as datatype,
-                          sys.length as character_maximum_length,
-                          case when sys.typename = 'DECIMAL' then sys.length else null end as numeric_precision,
-                          sys.scale as numeric_scale,
-                    FROM syscat.columns sys
-                """)
-            else:
-                cursor.execute("""
-                SELECT table_schema,
-                       table_name,
-                       column_name,
-                       data_type,
-                       character_maximum_length,
-                       numeric_precision,
-                       numeric_scale
-                  FROM qsys2.syscolumns
-                """)
-        yield from yield_jdbc(cursor)
-
-def _query_primary_keys(config):
-    """Queries the qsys2 primary key catalog and returns an iterator containing
-    the raw results."""
-    with get_cursor(config) as cursor:
-        if config["db_type"] == "DB2":
-            cursor.execute("""
-                SELECT
-                       a.tabschema as table_schema,
-                       a.tabname as table_name,
-                       a.colname as column_name,
-                       a.colseq as ordinal_position
-                FROM
-                    --qsys2.syskeycst A
-                     syscat.keycoluse a
-                JOIN
-                    --qsys2.syscst B
-                    syscat.tabconst b
-                ON
-                    a.tabschema = b.tabschema
-                    AND a.constname = b.constname
-                WHERE
-                      b.type = 'P'
-            """)
-        else:
-            cursor.execute("""
-                SELECT A.table_schema,
-                       A.table_name,
-                       A.column_name,
-                       A.ordinal_position
-                  FROM qsys2.syskeycst A
-                  JOIN qsys2.syscst B
-                    ON A.constraint_schema = B.constraint_schema
-                   AND A.constraint_name = B.constraint_name
-                 WHERE B.constraint_type = 'PRIMARY KEY'
-            """)
-        yield from yield_jdbc(cursor)
 
-
-def _table_id(table):
-    """Returns a 2-tuple that can be used to uniquely identify the table."""
-    return (table.table_schema, table.table_name)
-
-
-def _find_tables(config):
-    # We use the qsys2.systables catalog rather than
-    # information_schema.tables because it contains better information
-    # about the "table_type." The information_schema table doesn't
-    # distinguish between tables and data files.
-    tbls = [Table(*rec) for rec in _query_tables(config)]
-    return {_table_id(t): t for t in tbls}
-
-
-def _col_table_id(column):
-    """Returns a 2-tuple representing the column's table ID. See also
-    _table_id."""
-    return (column.table_schema, column.table_name)
-
-
-def _find_columns(config, tables):
-    cols = (Column(*rec) for rec in _query_columns(config))
-    ret = {}
-    for col in cols:
-        table_id = _col_table_id(col)
-        if table_id not in tables:
+def _table_id(rec):
+    """Returns a 2-tuple that can be used to uniquely identify the table a
+    catalog row belongs to."""
+    return (rec[0], rec[1])
+
+
+def _build_table(recs):
+    """Consumes the catalog rows of a single table and returns a 3-tuple of
+    the Table, its columns and its primary key columns, sorted by their
+    ordinal position."""
+    table = None
+    cols = []
+    keys = []
+    seen = set()
+    for rec in recs:
+        if table is None:
+            table = Table(*rec[:3])
+        # A table without any columns still produces one row from the outer
+        # join, with all of the column fields set to NULL.
+        if rec[3] is None:
             continue
-        if tables[table_id].table_type not in SUPPORTED_TYPES:
+        # Guard against the key join matching a column more than once, which
+        # would otherwise duplicate the column and its primary key entry.
+        if rec[3] in seen:
             continue
-        if table_id not in ret:
-            ret[table_id] = []
-        ret[table_id].append(col)
-    return ret
-
-
-def _find_primary_keys(config, tables):
-    """Returns a dict of tuples -> list where the keys are \"table ids\" -
-    ie. the (schema name, table_name) and the values are the primary key
-    columns, sorted by their ordinal position."""
-    results = _query_primary_keys(config)
-    keys = {}
-    for (table_schema, table_name, column_name, ordinal_pos) in results:
-        table_id = (table_schema, table_name)
-        if table_id not in tables:
-            continue
-        if table_id not in keys:
-            keys[table_id] = []
-        # We append a 2-tuple containing the ordinal position first so we
-        # can sort the PKs by their ordinal position once this loop is
-        # done.
-        keys[table_id].append((ordinal_pos, column_name))
-    return {
-        k: [x[1] for x in sorted(v)]
-        for k, v in keys.items()
-    }
+        seen.add(rec[3])
+        col = Column(rec[0], rec[1], *rec[3:9])
+        cols.append(col)
+        if rec[9] is not None:
+            # We append a 2-tuple containing the ordinal position first so
+            # we can sort the PKs by their ordinal position once this loop
+            # is done.
+            keys.append((rec[9], col.column_name))
+    return table, cols, [c for _, c in sorted(keys, key=itemgetter(0))]
 
 
 def _create_column_metadata(cols, schema, pk_columns):
-    mdata = {() : {'table-key-properties' : pk_columns}}
-    mdata = metadata.write(mdata, (), "selected-by-default", False)
+    # The metadata is built as a plain dict rather than through repeated
+    # metadata.write calls since this runs for every column of every table.
+    mdata = {(): {"table-key-properties": pk_columns,
+                  "selected-by-default": False}}
+    properties = schema.properties
     for col in cols:
-        col_schema = schema.properties[col.column_name]
-        mdata = metadata.write(mdata,
-                               breadcrumb=("properties", col.column_name),
-                               k="selected-by-default",
-                               val=(col_schema.inclusion != "unsupported"))
-        mdata = metadata.write(mdata,
-                               breadcrumb=("properties", col.column_name),
-                               k="sql-datatype",
-                               val=col.data_type.lower())
-
-    mdata = metadata.write(mdata, breadcrumb=(), k="valid-replication-keys",
-                           val=schemas.valid_replication_keys(cols))
+        col_schema = properties[col.column_name]
+        mdata[("properties", col.column_name)] = {
+            "selected-by-default": col_schema.inclusion != "unsupported",
+            "sql-datatype": col.data_type,
+        }
+    mdata[()]["valid-replication-keys"] = schemas.valid_replication_keys(cols)
     return metadata.to_list(mdata)
 
 
 def _update_entry_for_table_type(catalog_entry, table_type):
     catalog_entry.is_view = table_type == "V"
-    # https://www.ibm.com/support/knowledgecenter/ssw_ibm_i_71/db2/rbafzcatsystbls.htm
-    known_types = {
-        "A": "Alias",
-        "L": "Logical file",
-        "M": "Materialized query table",
-        "P": "Physical file",
-    }
     if table_type not in SUPPORTED_TYPES:
         catalog_entry.schema.inclusion = "unsupported"
-        hint = known_types.get(table_type, "Unknown")
+        hint = KNOWN_TABLE_TYPES.get(table_type, "Unknown")
         err = "Unsupported table type {} ({})".format(table_type, hint)
         catalog_entry.schema.description = err
 
 
-def discover(config):
-    tables = _find_tables(config)
-    columns = _find_columns(config, tables)
-    pks = _find_primary_keys(config, tables)
-    entries = []
-    for table_id in tables:
-        table_schema, table_name = table_id
-        cols = columns.get(table_id, [])
-        pk_columns = pks.get(table_id, [])
+def _discover_entries(config):
+    """Yields a CatalogEntry for each discovered table, one table at a
+    time."""
+    # groupby only merges adjacent rows, so this relies on _query_catalog
+    # ordering its results by table. Otherwise a table's columns would be
+    # split across several catalog entries.
+    for _, recs in groupby(_query_catalog(config), key=_table_id):
+        table, cols, pk_columns = _build_table(recs)
+        table_schema, table_name = table.table_schema, table.table_name
         schema = schemas.generate(cols, pk_columns)
         entry = CatalogEntry(
             database=table_schema,
             table=table_name,
             stream=table_name,
             metadata=_create_column_metadata(cols, schema, pk_columns),
-            tap_stream_id="{}-{}".format(table_schema, table_name),
+            tap_stream_id=f"{table_schema}-{table_name}",
             schema=schema)
+        if pk_columns:
+            entry.key_properties = pk_columns
+
+        _update_entry_for_table_type(entry, table.table_type)
+        yield entry
 
-        _update_entry_for_table_type(entry, tables[table_id].table_type)
-        entries.append(entry)
-    return Catalog(entries)
+
+def discover(config):
+    return Catalog(list(_discover_entries(config)))
+
+
+def stream_discover(config, out):
+    """Writes the discovered catalog to `out` as JSON one entry at a time,
+    so only a single table's entry needs to be held in memory."""
+    out.write('{"streams": [')
+    for i, entry in enumerate(_discover_entries(config)):
+        if i:
+            out.write(",")
+        out.write("\n")
+        json.dump(entry.to_dict(), out, indent=2)
+    out.write("\n]}")
@@ -1,12 +1,16 @@
 """Contains functionality for converting DB2 catalog results into
 Singer schemas."""
+import copy
+import functools
 from singer.catalog import Schema
 
 # https://www.ibm.com/support/knowledgecenter/ssw_ibm_i_71/db2/rbafzch2num.htm
-BYTES_FOR_INTEGER_TYPE = {
-    "smallint": 2,
-    "integer": 4,
-    "bigint": 8,
+# (minimum, maximum) for each type, ie. the range of a 2, 4 and 8 byte
+# signed integer.
+INT_BOUNDS = {
+    "smallint": (-2 ** 15, 2 ** 15 - 1),
+    "integer": (-2 ** 31, 2 ** 31 - 1),
+    "bigint": (-2 ** 63, 2 ** 63 - 1),
 }
 FLOAT_TYPES = {
     "float",
@@ -44,34 +48,33 @@ VALID_REPLICATION_KEY_TYPES = {
 
 # Parent article for data types:
 # https://www.ibm.com/support/knowledgecenter/ssw_ibm_i_71/db2/rbafzch2data.htm
-def _for_column(col, pk_columns):
-    data_type = col.data_type.lower()
-    inclusion = "available"
-    if col.column_name.lower() in [x.lower() for x in pk_columns]:
-        inclusion = "automatic"
-    result = Schema(inclusion=inclusion)
-    if data_type in BYTES_FOR_INTEGER_TYPE:
+@functools.lru_cache(maxsize=4096)
+def _schema_for_shape(data_type, character_maximum_length, numeric_precision,
+                      numeric_scale, ccsid):
+    """Returns the Schema for a column of the given shape. Catalogs tend to
+    repeat a handful of shapes across many columns so the results are cached
+    and shared; callers must copy them before making any changes."""
+    result = Schema(inclusion="available")
+    if data_type in INT_BOUNDS:
         result.type = ["null", "integer"]
-        bits = BYTES_FOR_INTEGER_TYPE[data_type] * 8
-        result.minimum = 0 - 2 ** (bits - 1)
-        result.maximum = 2 ** (bits - 1) - 1
+        result.minimum, result.maximum = INT_BOUNDS[data_type]
     elif data_type in FLOAT_TYPES:
         result.type = ["null", "number"]
     elif data_type in DECIMAL_TYPES:
         result.type = ["null", "number"]
         result.exclusiveMaximum = True
-        result.maximum = 10 ** (col.numeric_precision - col.numeric_scale)
+        result.maximum = 10 ** (numeric_precision - numeric_scale)
         result.exclusiveMinimum = True
-        result.minimum = -10 ** (col.numeric_precision - col.numeric_scale)
-        result.multipleOf = 10 ** (0 - col.numeric_scale)
+        result.minimum = -10 ** (numeric_precision - numeric_scale)
+        result.multipleOf = 10 ** (0 - numeric_scale)
     elif data_type in STRING_TYPES:
-        if col.ccsid in UNSUPPORTED_CCSIDS:
-            err = "Unsupported CCSID {}".format(col.ccsid)
+        if ccsid in UNSUPPORTED_CCSIDS:
+            err = "Unsupported CCSID {}".format(ccsid)
             result = Schema(None, inclusion="unsupported", description=err)
         else:
             result.type = ["null", "string"]
-            if col.character_maximum_length > 0:
-                result.maxLength = col.character_maximum_length
+            if character_maximum_length > 0:
+                result.maxLength = character_maximum_length
     elif data_type in DATETIME_TYPES:
         result.type = ["null", "string"]
         result.format = "date-time"
@@ -81,11 +84,25 @@ def _for_column(col, pk_columns):
     return result
 
 
+def _for_column(col, pk_lower):
+    result = _schema_for_shape(col.data_type,
+                               col.character_maximum_length,
+                               col.numeric_precision,
+                               col.numeric_scale,
+                               col.ccsid)
+    if (result.inclusion == "available"
+            and col.column_name.lower() in pk_lower):
+        result = copy.copy(result)
+        result.inclusion = "automatic"
+    return result
+
+
 def generate(columns, pk_columns):
-    properties = {c.column_name: _for_column(c, pk_columns) for c in columns}
+    pk_lower = frozenset(x.lower() for x in pk_columns)
+    properties = {c.column_name: _for_column(c, pk_lower) for c in columns}
     return Schema(type="object", properties=properties)
 
 
 def valid_replication_keys(columns):
     return [c.column_name for c in columns
-            if c.data_type.lower() in VALID_REPLICATION_KEY_TYPES]
+            if c.data_type in VALID_REPLICATION_KEY_TYPES]
@@ -0,0 +1,38 @@
+import mock
+import pytest
+import tap_db2.common as c
+
+
+class FakeCursor(object):
+    def __init__(self, rows, arraysize):
+        self.rows = list(rows)
+        self.arraysize = arraysize
+        self.fetch_sizes = []
+
+    def fetchmany(self, size):
+        self.fetch_sizes.append(size)
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+
+def test_yield_jdbc_reads_every_batch():
+    rows = [("a ", 1), ("b", 2), ("c  ", 3), ("d", 4), ("e", None)]
+    cursor = FakeCursor(rows, arraysize=2)
+    assert list(c.yield_jdbc(cursor)) == [
+        ["a", 1], ["b", 2], ["c", 3], ["d", 4], ["e", None]]
+    assert cursor.fetch_sizes == [2, 2, 2, 2]
+
+
+@mock.patch("tap_db2.common.connection")
+def test_get_cursor_sets_fetch_batch_size(connection_mock):
+    with c.get_cursor({"fetch_batch_size": "50"}) as cursor:
+        assert cursor.arraysize == 50
+    with c.get_cursor({}) as cursor:
+        assert cursor.arraysize == c.DEFAULT_FETCH_BATCH_SIZE
+
+
+@mock.patch("tap_db2.common.connection")
+def test_get_cursor_rejects_non_positive_fetch_batch_size(connection_mock):
+    with pytest.raises(ValueError):
+        c.get_cursor({"fetch_batch_size": 0})
+    connection_mock.assert_not_called()
@@ -1,3 +1,5 @@
+import io
+import json
 import mock
 import tap_db2.discovery as d
 
@@ -8,21 +10,15 @@ def _update(dict_, **kwargs):
     return new
 
 
-@mock.patch("tap_db2.discovery._query_tables")
-@mock.patch("tap_db2.discovery._query_columns")
-@mock.patch("tap_db2.discovery._query_primary_keys")
-def test_basic_discovery(pks_mock, columns_mock, tables_mock):
-    tables_mock.return_value = [
-        ("a_schema", "a_table", "T"),
-    ]
-    columns_mock.return_value = [
-        ("a_schema", "a_table", "a_column", "FLOAT", None, None, None),
-        ("a_schema", "a_table", "b_column", "FLOAT", None, None, None),
-        ("a_schema", "a_table", "c_column", "FLOAT", None, None, None),
-    ]
-    pks_mock.return_value = [
-        ("a_schema", "a_table", "a_column", 2),
-        ("a_schema", "a_table", "b_column", 1),
+@mock.patch("tap_db2.discovery._query_catalog")
+def test_basic_discovery(catalog_mock):
+    catalog_mock.return_value = [
+        ("a_schema", "a_table", "T",
+         "a_column", "float", None, None, None, None, 2),
+        ("a_schema", "a_table", "T",
+         "b_column", "float", None, None, None, None, 1),
+        ("a_schema", "a_table", "T",
+         "c_column", "float", None, None, None, None, None),
     ]
     ctx = mock.MagicMock()
     catalog = d.discover(ctx).to_dict()
@@ -47,7 +43,10 @@ def test_basic_discovery(pks_mock, columns_mock, tables_mock):
         "is_view": False,
         "key_properties": ["b_column", "a_column"],
         "metadata": [{"breadcrumb": (),
-                      "metadata": {"selected-by-default": False}},
+                      "metadata": {"selected-by-default": False,
+                                   "table-key-properties": ["b_column",
+                                                            "a_column"],
+                                   "valid-replication-keys": []}},
                      {"breadcrumb": ("properties", "a_column"),
                       "metadata": {"selected-by-default": True,
                                    "sql-datatype": "float"}},
@@ -61,15 +60,11 @@ def test_basic_discovery(pks_mock, columns_mock, tables_mock):
 
 
 
-@mock.patch("tap_db2.discovery._query_tables")
-@mock.patch("tap_db2.discovery._query_columns")
-@mock.patch("tap_db2.discovery._query_primary_keys")
-def test_decimal_types(pks_mock, columns_mock, tables_mock):
-    tables_mock.return_value = [
-        ("a_schema", "a_table", "T"),
-    ]
-    columns_mock.return_value = [
-        ("a_schema", "a_table", "a_column", "decimal", None, 10, 4),
+@mock.patch("tap_db2.discovery._query_catalog")
+def test_decimal_types(catalog_mock):
+    catalog_mock.return_value = [
+        ("a_schema", "a_table", "T",
+         "a_column", "decimal", None, 10, 4, None, None),
     ]
     ctx = mock.MagicMock()
     catalog = d.discover(ctx).to_dict()
@@ -87,3 +82,67 @@ def test_decimal_types(pks_mock, columns_mock, tables_mock):
                       "minimum": -expected_limit,
                       "maximum": expected_limit,
                       "multipleOf": 0.0001}
+
+
+@mock.patch("tap_db2.discovery._query_catalog")
+def test_one_entry_per_table(catalog_mock):
+    catalog_mock.return_value = [
+        ("a_schema", "a_table", "T",
+         "a_column", "float", None, None, None, None, None),
+        ("a_schema", "a_table", "T",
+         "b_column", "float", None, None, None, None, None),
+        ("a_schema", "b_table", "V",
+         None, None, None, None, None, None, None),
+        ("b_schema", "a_table", "T",
+         "c_column", "float", None, None, None, None, None),
+    ]
+    ctx = mock.MagicMock()
+    streams = d.discover(ctx).to_dict()["streams"]
+    assert [s["tap_stream_id"] for s in streams] == [
+        "a_schema-a_table", "a_schema-b_table", "b_schema-a_table"]
+    assert list(streams[0]["schema"]["properties"]) == ["a_column",
+                                                        "b_column"]
+    assert not streams[1]["schema"].get("properties")
+    assert streams[1]["is_view"]
+    assert list(streams[2]["schema"]["properties"]) == ["c_column"]
+
+
+@mock.patch("tap_db2.discovery._query_catalog")
+def test_stream_discover_matches_discover(catalog_mock):
+    catalog_mock.return_value = [
+        ("a_schema", "a_table", "T",
+         "a_column", "integer", None, None, None, None, 1),
+        ("a_schema", "b_table", "T",
+         "b_column", "decimal", None, 10, 4, None, None),
+    ]
+    ctx = mock.MagicMock()
+    out = io.StringIO()
+    d.stream_discover(ctx, out)
+    expected = json.loads(json.dumps(d.discover(ctx).to_dict()))
+    assert json.loads(out.getvalue()) == expected
+
+
+@mock.patch("tap_db2.discovery._query_catalog")
+def test_duplicate_column_rows(catalog_mock):
+    catalog_mock.return_value = [
+        ("a_schema", "a_table", "T",
+         "id", "integer", None, None, None, None, 1),
+        ("a_schema", "a_table", "T",
+         "id", "integer", None, None, None, None, 1),
+        ("a_schema", "a_table", "T",
+         "name", "varchar", 50, None, None, None, None),
+    ]
+    ctx = mock.MagicMock()
+    stream = d.discover(ctx).to_dict()["streams"][0]
+    assert stream["key_properties"] == ["id"]
+    assert list(stream["schema"]["properties"]) == ["id", "name"]
+    assert stream["schema"]["properties"]["id"]["inclusion"] == "automatic"
+    assert stream["schema"]["properties"]["name"]["maxLength"] == 50
+    mdata = {tuple(m["breadcrumb"]): m["metadata"]
+             for m in stream["metadata"]}
+    assert mdata[()]["table-key-properties"] == ["id"]
+    assert mdata[()]["valid-replication-keys"] == ["id"]
+    assert mdata[("properties", "id")] == {"selected-by-default": True,
+                                           "sql-datatype": "integer"}
+    assert mdata[("properties", "name")] == {"selected-by-default": True,
+                                             "sql-datatype": "varchar"}